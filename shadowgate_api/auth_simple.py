@@ -2,6 +2,7 @@
 import hashlib
 import secrets
 import os
+from datetime import datetime, timedelta, timezone
 from types import SimpleNamespace
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
@@ -9,6 +10,8 @@ from jose import jwt, JWTError           # pip install python-jose
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
+from shadowgate_api.db import get_db
+
 # --- existing helpers (kept) ---
 def hash_password(pw: str) -> str:
     salt = secrets.token_hex(16)
@@ -25,15 +28,25 @@ def verify_password(pw: str, stored: str) -> bool:
 
 # --- NEW: JWT auth dependency ---
 # Must match whatever you used to SIGN the token when logging in / registering
-JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
+# (routers/users.py signs with SECRET_KEY, so fall back to it)
+JWT_SECRET = os.getenv("JWT_SECRET") or os.getenv("SECRET_KEY", "dev-secret-change-me")
 JWT_ALG = "HS256"
 bearer = HTTPBearer(auto_error=False)
 
-def _decode_token(token: str) -> dict:
+# Short-lived, single-purpose tokens for clients that can only pass a query
+# string (EventSource). A ticket is scoped by its 'aud' claim, so it is never
+# accepted as a regular bearer token, and vice versa.
+STREAM_TICKET_AUDIENCE = "loan-events"
+STREAM_TICKET_TTL_SECONDS = int(os.getenv("STREAM_TICKET_TTL_SECONDS", "60"))
+
+def _decode_token(token: str, audience: str | None = None) -> dict:
     try:
-        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG], audience=audience)
     except JWTError as e:
         raise HTTPException(status_code=401, detail="Invalid or expired token") from e
+    if payload.get("aud") != audience:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return payload
 
 def _load_user(db: Session, username: str) -> SimpleNamespace:
     row = db.execute(
@@ -45,9 +58,22 @@ def _load_user(db: Session, username: str) -> SimpleNamespace:
     # return an object with attributes like .id, .username, .role, .bases
     return SimpleNamespace(**row)
 
+def user_from_token(db: Session, token: str, audience: str | None = None) -> SimpleNamespace:
+    """Decode a JWT (bearer token, or a ticket when audience is given) and load its user."""
+    payload = _decode_token(token, audience)
+    username = payload.get("sub")
+    if not username:
+        raise HTTPException(status_code=401, detail="Token missing 'sub'")
+    return _load_user(db, username)
+
+def make_stream_ticket(username: str) -> str:
+    expire = datetime.now(timezone.utc) + timedelta(seconds=STREAM_TICKET_TTL_SECONDS)
+    payload = {"sub": username, "aud": STREAM_TICKET_AUDIENCE, "exp": expire}
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
+
 def get_current_user(
     creds: HTTPAuthorizationCredentials = Depends(bearer),
-    db: Session = Depends(lambda: __import__("shadowgate_api.db", fromlist=["get_db"]).db.SessionLocal()),
+    db: Session = Depends(get_db),
 ):
     """
     FastAPI dependency:
@@ -57,8 +83,4 @@ def get_current_user(
     """
     if not creds or not creds.scheme.lower() == "bearer":
         raise HTTPException(status_code=401, detail="Missing bearer token")
-    payload = _decode_token(creds.credentials)
-    username = payload.get("sub")
-    if not username:
-        raise HTTPException(status_code=401, detail="Token missing 'sub'")
-    return _load_user(db, username)
+    return user_from_token(db, creds.credentials)
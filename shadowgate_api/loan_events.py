@@ -0,0 +1,156 @@
+# shadowgate_api/loan_events.py
+"""
+In-process fan-out of loan change notifications.
+
+The loans_notify trigger (models.sql) publishes a JSON payload on the
+'loan_events' channel whenever a loan row is inserted or changed. Each worker
+process keeps ONE dedicated LISTEN connection in a background thread and
+hands every notification to the asyncio queues of that user's subscribers.
+Queues are bounded. When a queue overflows, or the listener had to
+reconnect (notifications sent meanwhile are lost), subscribers get a RESYNC
+event and should re-read current state instead of trusting the event stream.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+import psycopg2.extensions
+
+from shadowgate_api.db import DATABASE_URL
+
+CHANNEL = "loan_events"
+QUEUE_MAX = int(os.getenv("LOAN_EVENTS_QUEUE_MAX", "32"))
+MAX_SUBSCRIBERS_PER_USER = int(os.getenv("LOAN_EVENTS_MAX_PER_USER", "5"))
+RECONNECT_DELAY = 5.0
+# An idle LISTEN connection receives nothing, so a peer that vanished (NAT,
+# proxy, failover) is only noticed by probing: a SELECT 1 after IDLE_PROBE
+# seconds of silence, plus TCP keepalives and a send timeout as backstops.
+IDLE_PROBE_SECONDS = 30
+CONNECT_OPTIONS = {
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 3,
+    "tcp_user_timeout": 30000,  # ms; a probe stuck on a dead socket fails instead of waiting out TCP retries
+}
+RESYNC = {"event": "resync"}
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def _offer(q: asyncio.Queue, event: dict) -> None:
+    # Runs on the subscriber's event loop. On overflow the queued events are
+    # no longer a complete history, so replace them with a single RESYNC.
+    if q.full():
+        while not q.empty():
+            q.get_nowait()
+        event = RESYNC
+    q.put_nowait(event)
+
+
+class LoanEventHub:
+    def __init__(self, dsn: str = DATABASE_URL, channel: str = CHANNEL):
+        self._dsn = dsn
+        self._channel = channel
+        self._subs = defaultdict(dict)  # user_id -> {queue: loop}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._listening = threading.Event()
+        self._reconnecting = False
+
+    # --- subscriber side (called from the event loop) ---
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        q = asyncio.Queue(maxsize=QUEUE_MAX)
+        with self._lock:
+            if len(self._subs[user_id]) >= MAX_SUBSCRIBERS_PER_USER:
+                raise TooManySubscribers(user_id)
+            self._subs[user_id][q] = loop
+            self._ensure_listener()
+        return q
+
+    def wait_listening(self, timeout: float) -> bool:
+        """Block until LISTEN is active; events committed after this are delivered."""
+        return self._listening.wait(timeout)
+
+    def unsubscribe(self, user_id: int, q: asyncio.Queue) -> None:
+        with self._lock:
+            subs = self._subs.get(user_id)
+            if subs is not None:
+                subs.pop(q, None)
+                if not subs:
+                    del self._subs[user_id]
+
+    # --- listener side (background thread) ---
+    def _ensure_listener(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="loan-events-listener", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                print(f"[loan_events] listener error: {e}; reconnecting in {RECONNECT_DELAY:.0f}s")
+            finally:
+                self._listening.clear()
+            time.sleep(RECONNECT_DELAY)
+
+    def _listen(self) -> None:
+        conn = psycopg2.connect(self._dsn, **CONNECT_OPTIONS)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {self._channel}")
+            print(f"[loan_events] listening on '{self._channel}'")
+            self._listening.set()
+            if self._reconnecting:
+                # Anything sent while we were not listening is gone.
+                self._broadcast(RESYNC)
+            self._reconnecting = True
+            while True:
+                if select.select([conn], [], [], IDLE_PROBE_SECONDS) == ([], [], []):
+                    # Raises on a dead connection, which reconnects and RESYNCs.
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                else:
+                    conn.poll()
+                while conn.notifies:
+                    self._dispatch(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def _dispatch(self, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+            user_id = int(event["user_id"])
+        except (ValueError, KeyError, TypeError):
+            print(f"[loan_events] ignoring malformed payload: {payload!r}")
+            return
+        with self._lock:
+            targets = list(self._subs.get(user_id, {}).items())
+        self._deliver(targets, event)
+
+    def _broadcast(self, event: dict) -> None:
+        with self._lock:
+            targets = [t for subs in self._subs.values() for t in subs.items()]
+        self._deliver(targets, event)
+
+    @staticmethod
+    def _deliver(targets, event: dict) -> None:
+        for q, loop in targets:
+            try:
+                loop.call_soon_threadsafe(_offer, q, event)
+            except RuntimeError:  # loop already closed; unsubscribe will follow
+                pass
+
+
+hub = LoanEventHub()
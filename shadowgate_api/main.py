@@ -6,10 +6,10 @@ from fastapi import FastAPI
 from sqlalchemy.exc import SQLAlchemyError
 
 from shadowgate_api.db import Base, engine
-from shadowgate_api.routers import users, admin
+from shadowgate_api.routers import users, admin, loans
 from shadowgate_api.routers import loan_eligibility as elig
 # Enable when those endpoints are ready:
-# from shadowgate_api.routers import loans, trades
+# from shadowgate_api.routers import trades
 
 app = FastAPI(title="Shadowgate API")
 
@@ -89,5 +89,5 @@ def root():
 app.include_router(users.router)   # /api/users...
 app.include_router(admin.router)   # /api/admin...
 app.include_router(elig.router)    # /api/eligibility...
-# app.include_router(loans.router)
+app.include_router(loans.router)   # /api/loans...
 # app.include_router(trades.router)
@@ -80,3 +80,87 @@ SELECT *
 FROM loans
 WHERE status = 'active'
   AND (end_date IS NULL OR end_date > NOW());
+
+-- =========================
+-- LOAN ARCHIVE (cold history)
+-- =========================
+-- Closed/rejected loans past the retention window are moved here in batches by
+-- utils/archive_loans.py, so the hot `loans` table (and idx_loans_user,
+-- idx_loans_status, uniq_active_loan_per_user) only carries recent rows.
+-- Active loans never move, so the one-active-loan guarantee and active_loans_v
+-- are untouched. Partitioned by date_granted year; the archiver creates
+-- loans_archive_<year> partitions on demand.
+CREATE TABLE IF NOT EXISTS loans_archive (
+  id                  INTEGER NOT NULL,                     -- original loans.id
+  user_id             INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  loan_type           TEXT    NOT NULL,
+  plan                TEXT    NOT NULL,
+  amount              BIGINT  NOT NULL,
+  repayment_rate      NUMERIC(6,4) NOT NULL,
+  interest_rate       NUMERIC(6,2) NOT NULL,
+  total_interest_paid BIGINT  NOT NULL,
+  duration_weeks      INTEGER,
+  date_granted        TIMESTAMPTZ NOT NULL,
+  end_date            TIMESTAMPTZ,
+  status              TEXT NOT NULL CHECK (status IN ('closed','rejected')),
+  archived_at         TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, date_granted)
+) PARTITION BY RANGE (date_granted);
+
+CREATE INDEX IF NOT EXISTS idx_loans_archive_user ON loans_archive (user_id);
+
+-- Full history (hot + archived). Use for reporting/exports, not hot paths.
+CREATE OR REPLACE VIEW loans_all_v AS
+SELECT id, user_id, loan_type, plan, amount, repayment_rate, interest_rate,
+       total_interest_paid, duration_weeks, date_granted, end_date, status
+FROM loans
+UNION ALL
+SELECT id, user_id, loan_type, plan, amount, repayment_rate, interest_rate,
+       total_interest_paid, duration_weeks, date_granted, end_date, status
+FROM loans_archive;
+
+-- =========================
+-- LOAN CHANGE NOTIFICATIONS
+-- =========================
+-- Publishes one JSON payload per inserted/changed loan on channel 'loan_events'.
+-- The API fans these out to per-user server-sent event streams (see loan_events.py).
+-- event: 'created' on insert, 'closed' when status leaves 'active', else 'updated'.
+CREATE OR REPLACE FUNCTION loans_notify() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('loan_events', json_build_object(
+    'event', CASE
+               WHEN TG_OP = 'INSERT' THEN 'created'
+               WHEN OLD.status = 'active' AND NEW.status <> 'active' THEN 'closed'
+               ELSE 'updated'
+             END,
+    'loan_id', NEW.id,
+    'user_id', NEW.user_id,
+    'status', NEW.status,
+    'amount', NEW.amount,
+    'end_date', NEW.end_date
+  )::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create the triggers only when missing: models.sql runs on every worker start,
+-- and DROP TRIGGER takes an ACCESS EXCLUSIVE lock on loans that would queue
+-- behind long exports (and every query on loans behind it).
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                 WHERE tgname = 'loans_notify_ins' AND tgrelid = 'loans'::regclass) THEN
+    CREATE TRIGGER loans_notify_ins
+      AFTER INSERT ON loans
+      FOR EACH ROW EXECUTE FUNCTION loans_notify();
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                 WHERE tgname = 'loans_notify_upd' AND tgrelid = 'loans'::regclass) THEN
+    CREATE TRIGGER loans_notify_upd
+      AFTER UPDATE ON loans
+      FOR EACH ROW
+      WHEN (OLD.* IS DISTINCT FROM NEW.*)
+      EXECUTE FUNCTION loans_notify();
+  END IF;
+END
+$$;
@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from jose import jwt, JWTError
 from pydantic import BaseModel
 from typing import List, Optional
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+import csv
+import io
+import json
 import os
+import zlib
 
-from shadowgate_api.db import get_db
+from shadowgate_api.db import engine, get_db
 from shadowgate_api.routers.users import User
 from shadowgate_api.auth_simple import hash_password
 
@@ -15,6 +23,20 @@ router = APIRouter(prefix="/api/admin", tags=["Admin"])
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-change-me")
 ALGORITHM = "HS256"
 
+# --- Export config ---
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+EXPORT_FORMATS = ("csv", "ndjson")
+LOAN_STATUSES = ("active", "closed", "rejected")
+
+LOAN_EXPORT_COLUMNS = [
+    "loan_id", "user_id", "username", "ingame_username", "company_code",
+    "loan_type", "plan", "amount", "repayment_rate", "interest_rate",
+    "total_interest_paid", "duration_weeks", "date_granted", "end_date", "status",
+]
+USER_EXPORT_COLUMNS = [
+    "id", "username", "role", "ingame_username", "company_code", "bases", "created_at",
+]
+
 # --- Schemas ---
 class UserOut(BaseModel):
     id: int
@@ -63,6 +85,93 @@ def get_current_admin(authorization: str = Header(None)):
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
 
+def _json_default(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return str(v)
+    raise TypeError(f"Not JSON serializable: {type(v).__name__}")
+
+
+# Cells starting with these are evaluated as formulas by spreadsheet apps.
+_CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_value(v):
+    if v is None:
+        return ""
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, str) and v.startswith(_CSV_FORMULA_PREFIXES):
+        return "'" + v
+    return v
+
+
+def _encode_rows(rows, columns: List[str], fmt: str) -> bytes:
+    buf = io.StringIO()
+    if fmt == "csv":
+        w = csv.writer(buf)
+        for r in rows:
+            w.writerow([_csv_value(r[c]) for c in columns])
+    else:
+        for r in rows:
+            buf.write(json.dumps({c: r[c] for c in columns}, default=_json_default))
+            buf.write("\n")
+    return buf.getvalue().encode("utf-8")
+
+
+def _stream_query(sql: str, params: dict, columns: List[str], fmt: str, gz: bool):
+    """
+    Yield encoded chunks of a query result without materialising it.
+    Uses a dedicated connection with a server-side cursor (stream_results),
+    fetching EXPORT_CHUNK_ROWS at a time, so memory stays bounded by one chunk
+    regardless of how many rows the export covers.
+    """
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31) if gz else None  # wbits=31 -> gzip container
+
+    def emit(data: bytes) -> bytes:
+        return comp.compress(data) if comp else data
+
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=EXPORT_CHUNK_ROWS
+        ).execute(text(sql), params).mappings()
+
+        if fmt == "csv":
+            head = io.StringIO()
+            csv.writer(head).writerow(columns)
+            out = emit(head.getvalue().encode("utf-8"))
+            if out:
+                yield out
+
+        for part in result.partitions():
+            out = emit(_encode_rows(part, columns, fmt))
+            if out:
+                yield out
+
+    if comp:
+        tail = comp.flush()
+        if tail:
+            yield tail
+
+
+def _export_response(sql: str, params: dict, columns: List[str], name: str, fmt: str, gz: bool):
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format; expected one of {', '.join(EXPORT_FORMATS)}")
+
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"
+    if gz:
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    return StreamingResponse(
+        _stream_query(sql, params, columns, fmt, gz),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 # --- Endpoints (admin-only) ---
 
 @router.get("/users", response_model=List[UserOut], dependencies=[Depends(get_current_admin)])
@@ -117,3 +226,67 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     db.delete(user)
     db.commit()
     return {"message": f"User {user.username} deleted successfully."}
+
+
+# --- Exports (admin-only, streamed) ---
+
+@router.get("/export/loans", dependencies=[Depends(get_current_admin)])
+def export_loans(
+    format: str = Query("csv", description="csv | ndjson"),
+    gzip: bool = Query(False, description="gzip-compress the stream"),
+    status: Optional[List[str]] = Query(None, description="Repeatable: active | closed | rejected"),
+    date_from: Optional[date] = Query(None, description="date_granted >= this day (UTC)"),
+    date_to: Optional[date] = Query(None, description="date_granted < the day after this (UTC)"),
+    user_id: Optional[int] = None,
+):
+    """
+    Stream every loan (hot and archived) joined with its user, oldest first.
+    Filters map onto idx_loans_status / idx_loans_user so the planner
+    can skip the bulk of history when a status or user is given.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+
+    where = []
+    params = {}
+    if status:
+        statuses = [s.lower() for s in status]
+        bad = [s for s in statuses if s not in LOAN_STATUSES]
+        if bad:
+            raise HTTPException(status_code=400, detail=f"Invalid status: {', '.join(bad)}")
+        where.append("l.status = ANY(:statuses)")
+        params["statuses"] = statuses
+    if user_id is not None:
+        where.append("l.user_id = :uid")
+        params["uid"] = user_id
+    if date_from:
+        where.append("l.date_granted >= :dfrom")
+        params["dfrom"] = datetime.combine(date_from, time.min, tzinfo=timezone.utc)
+    if date_to:
+        where.append("l.date_granted < :dto")
+        params["dto"] = datetime.combine(date_to + timedelta(days=1), time.min, tzinfo=timezone.utc)
+
+    sql = f"""
+        SELECT l.id AS loan_id, l.user_id, u.username, u.ingame_username, u.company_code,
+               l.loan_type, l.plan, l.amount, l.repayment_rate, l.interest_rate,
+               l.total_interest_paid, l.duration_weeks, l.date_granted, l.end_date, l.status
+        FROM loans_all_v l
+        JOIN users u ON u.id = l.user_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY l.id
+    """
+    return _export_response(sql, params, LOAN_EXPORT_COLUMNS, "loans", format.lower(), gzip)
+
+
+@router.get("/export/users", dependencies=[Depends(get_current_admin)])
+def export_users(
+    format: str = Query("csv", description="csv | ndjson"),
+    gzip: bool = Query(False, description="gzip-compress the stream"),
+):
+    """Stream all users (without password hashes or API keys)."""
+    sql = """
+        SELECT id, username, role, ingame_username, company_code, bases, created_at
+        FROM users
+        ORDER BY id
+    """
+    return _export_response(sql, {}, USER_EXPORT_COLUMNS, "users", format.lower(), gzip)
@@ -1,23 +1,98 @@
 # shadowgate_api/routers/loans.py
-from datetime import datetime, timedelta, timezone
-from math import ceil
+import asyncio
+import json
+import os
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from ..db import get_db
-from ..auth_simple import get_current_user  # adjust if you keep it elsewhere
+from ..db import SessionLocal, get_db
+from ..auth_simple import (  # adjust if you keep it elsewhere
+    STREAM_TICKET_AUDIENCE,
+    STREAM_TICKET_TTL_SECONDS,
+    bearer,
+    get_current_user,
+    make_stream_ticket,
+    user_from_token,
+)
+from ..loan_events import hub, RESYNC, TooManySubscribers
 
 router = APIRouter(prefix="/api/loans", tags=["loans"])
 
+HEARTBEAT_SECONDS = float(os.getenv("LOAN_EVENTS_HEARTBEAT", "15"))
+LISTEN_WAIT_SECONDS = 10.0
 
-def _utcnow():
-    return datetime.now(timezone.utc)
 
+# Class id for pg_advisory_xact_lock(int, int); the second key is the user id.
+APPLY_LOCK_NAMESPACE = 0x10A4
 
-@router.get("/active")
-def get_active_loan(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+
+def _reject(status_code: int, reason: str, message: str, **extra):
+    raise HTTPException(status_code=status_code, detail={"reason": reason, "message": message, **extra})
+
+
+_APPLY_SQL = text("""
+    WITH active AS (
+        SELECT amount
+        FROM loans
+        WHERE user_id = :uid AND status = 'active' AND end_date > NOW()
+        ORDER BY end_date DESC
+        LIMIT 1
+    ),
+    tier AS (
+        SELECT max_amount, interest
+        FROM loan_eligibility
+        WHERE bases = :bases AND lower(loan_type) = :lt
+        ORDER BY max_amount DESC
+        LIMIT 1
+    ),
+    decision AS (
+        SELECT
+            CASE
+                WHEN a.amount IS NOT NULL AND NOT :refi THEN 'active_loan_exists'
+                WHEN a.amount IS NOT NULL AND :amount > (a.amount + 1) / 2 THEN 'refinance_cap_exceeded'
+                WHEN a.amount IS NOT NULL THEN 'refinance_not_supported'
+                WHEN a.amount IS NULL AND t.max_amount IS NULL THEN 'tier_not_found'
+                WHEN a.amount IS NULL AND :amount > t.max_amount THEN 'amount_exceeds_limit'
+            END AS reason,
+            (a.amount + 1) / 2 AS max_refinance,
+            t.max_amount,
+            t.interest AS ir
+        FROM (SELECT 1) one
+        LEFT JOIN active a ON TRUE
+        LEFT JOIN tier t ON TRUE
+    ),
+    ins AS (
+        INSERT INTO loans
+        (user_id, loan_type, plan, amount, repayment_rate, interest_rate,
+         total_interest_paid, duration_weeks, end_date, status)
+        SELECT
+            :uid, :lt, :plan, :amount, :repay, d.ir,
+            ROUND(
+                CAST(:amount AS float8) * CAST(d.ir AS float8) / 100.0 *
+                CASE WHEN CAST(:repay AS float8) = 0 THEN CAST(:weeks AS float8)
+                     ELSE (1 - power(1 - CAST(:repay AS float8), :weeks)) / CAST(:repay AS float8)
+                END
+            ),
+            :dw, NOW() + make_interval(weeks => :weeks), 'active'
+        FROM decision d
+        WHERE d.reason IS NULL
+        ON CONFLICT (user_id) WHERE status = 'active' DO NOTHING
+        RETURNING id, interest_rate, total_interest_paid, date_granted, end_date
+    )
+    SELECT d.reason, d.max_refinance, d.max_amount,
+           i.id, i.interest_rate, i.total_interest_paid, i.date_granted, i.end_date
+    FROM decision d
+    LEFT JOIN ins i ON TRUE
+""")
+
+
+def _active_loan(db: Session, user_id: int) -> dict:
     q = text("""
         SELECT id, amount, end_date
         FROM loans
@@ -27,12 +102,106 @@ def get_active_loan(db: Session = Depends(get_db), current_user=Depends(get_curr
         ORDER BY end_date DESC
         LIMIT 1
     """)
-    row = db.execute(q, {"uid": current_user.id}).mappings().first()
+    row = db.execute(q, {"uid": user_id}).mappings().first()
     if row:
         return {"active": True, "loan_id": row["id"], "amount": int(row["amount"]), "ends_at": row["end_date"].isoformat()}
     return {"active": False}
 
 
+def _active_loan_fresh_session(user_id: int) -> dict:
+    db = SessionLocal()
+    try:
+        return _active_loan(db, user_id)
+    finally:
+        db.close()
+
+
+@router.get("/active")
+def get_active_loan(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    return _active_loan(db, current_user.id)
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8")
+
+
+def _stream_user(
+    creds: HTTPAuthorizationCredentials = Depends(bearer),
+    ticket: Optional[str] = Query(None, description="Stream ticket from POST /events/ticket"),
+):
+    """
+    Authenticate the stream once, with the bearer token or a stream ticket.
+    Uses its own short-lived session: a yield dependency (get_db) would keep a
+    pooled connection checked out for as long as the stream stays open.
+
+    Tickets exist because EventSource cannot send headers. They still end up in
+    proxy/access logs as a query parameter, which is accepted as a tradeoff:
+    they are scoped to this endpoint and expire after STREAM_TICKET_TTL_SECONDS.
+    """
+    db = SessionLocal()
+    try:
+        if creds and creds.scheme.lower() == "bearer":
+            return user_from_token(db, creds.credentials)
+        if ticket:
+            return user_from_token(db, ticket, audience=STREAM_TICKET_AUDIENCE)
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    finally:
+        db.close()
+
+
+@router.post("/events/ticket")
+def create_stream_ticket(current_user=Depends(get_current_user)):
+    return {"ticket": make_stream_ticket(current_user.username), "expires_in": STREAM_TICKET_TTL_SECONDS}
+
+
+@router.get("/events")
+async def stream_loan_events(request: Request, current_user=Depends(_stream_user)):
+    """
+    Server-sent events replacing polling of /active.
+    Sends a 'snapshot' (same shape as /active) on connect, then one
+    'created' / 'closed' / 'updated' event per change to the user's loans,
+    and a comment heartbeat every HEARTBEAT_SECONDS of silence. A fresh
+    'snapshot' is sent whenever the listener reconnects or the client's
+    queue overflows, since events may have been lost. Over the per-user
+    stream cap this is a plain 429, so EventSource clients stop instead of
+    reconnecting in a loop; 503 if the listener cannot reach Postgres.
+    """
+    user_id = current_user.id
+    try:
+        q = hub.subscribe(user_id)
+    except TooManySubscribers:
+        raise HTTPException(status_code=429, detail="Too many open event streams")
+
+    # Snapshot only once LISTEN is active, so every change committed after it
+    # is either in the snapshot or delivered as an event.
+    if not await run_in_threadpool(hub.wait_listening, LISTEN_WAIT_SECONDS):
+        hub.unsubscribe(user_id, q)
+        raise HTTPException(status_code=503, detail="Loan events unavailable")
+
+    async def gen():
+        try:
+            yield _sse("snapshot", await run_in_threadpool(_active_loan_fresh_session, user_id))
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(q.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if event is RESYNC:
+                    # listener reconnected or this client fell behind
+                    yield _sse("snapshot", await run_in_threadpool(_active_loan_fresh_session, user_id))
+                    continue
+                yield _sse(event.get("event", "updated"), event)
+        finally:
+            hub.unsubscribe(user_id, q)
+
+    return StreamingResponse(
+        gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/apply")
 def apply_loan(payload: dict, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
     """
@@ -54,99 +223,64 @@ def apply_loan(payload: dict, db: Session = Depends(get_db), current_user=Depend
     purpose = (payload.get("purpose") or "").lower()
 
     if loan_type not in ("std", "shp", "refinance"):
-        raise HTTPException(status_code=400, detail="Invalid loan_type")
+        _reject(400, "invalid_loan_type", "Invalid loan_type")
     if plan not in ("stable", "interest-only"):
-        raise HTTPException(status_code=400, detail="Invalid plan")
+        _reject(400, "invalid_plan", "Invalid plan")
     if amount <= 0 or weeks <= 0:
-        raise HTTPException(status_code=400, detail="Invalid amount/duration")
-    if plan == "stable" and not (0 <= repay <= 1):
-        raise HTTPException(status_code=400, detail="Invalid repayment_rate for stable plan")
+        _reject(400, "invalid_amount_or_duration", "Invalid amount/duration")
+    if plan == "stable" and not (0 < repay <= 1):
+        _reject(400, "invalid_repayment_rate", "Invalid repayment_rate for stable plan")
     if plan == "interest-only":
         repay = 0.0
 
-    # 1) Check for existing active loan
-    active = db.execute(text("""
-        SELECT id, amount, interest_rate
-        FROM loans
-        WHERE user_id = :uid AND status='active' AND end_date > NOW()
-        ORDER BY end_date DESC
-        LIMIT 1
-    """), {"uid": current_user.id}).mappings().first()
-
-    # 2) Refinancing special rule
-    if active:
-        if loan_type != "refinance" and purpose != "refinancing":
-            raise HTTPException(status_code=400, detail="Active loan exists; only refinancing allowed.")
-        max_ref = ceil(int(active["amount"]) / 2)
-        if amount > max_ref:
-            raise HTTPException(status_code=400, detail=f"Refinance cap is {max_ref}")
-        interest_rate = float(active["interest_rate"])  # same rate as existing
-    else:
-        # 3) Normal eligibility path: fetch static tier by bases + type
-        bases = getattr(current_user, "bases", None)
-        row = db.execute(text("""
-            SELECT max_amount, interest
-            FROM loan_eligibility
-            WHERE bases = :bases AND lower(loan_type) = :lt
-            ORDER BY max_amount DESC
-            LIMIT 1
-        """), {"bases": bases, "lt": loan_type}).mappings().first()
-        if not row:
-            raise HTTPException(status_code=404, detail="Eligibility tier not found.")
-        if amount > int(row["max_amount"]):
-            raise HTTPException(status_code=400, detail="Amount exceeds eligibility limit.")
-        interest_rate = float(row["interest"])  # % per week
-
-    # 4) Compute total interest (weekly)
-    r = interest_rate / 100.0
-    total_interest = 0.0
-    principal = float(amount)
-    if plan == "interest-only":
-        total_interest = principal * r * weeks
-    else:
-        # stable: remaining principal decays by 'repay' proportion weekly
-        for _ in range(weeks):
-            total_interest += principal * r
-            principal *= (1.0 - repay)
-
-    total_interest_paid = int(round(total_interest))
-    end_date = _utcnow() + timedelta(weeks=weeks)
-
-    # 5) Insert loan (will fail with 23505 if unique index blocks a second active loan)
-    ins = text("""
-        INSERT INTO loans
-        (user_id, loan_type, plan, amount, repayment_rate, interest_rate,
-         total_interest_paid, duration_weeks, end_date, status)
-        VALUES
-        (:uid, :lt, :plan, :amount, :repay, :ir, :tip, :weeks, :endd, 'active')
-        RETURNING id, date_granted, end_date
-    """)
     try:
-        ret = db.execute(ins, {
+        # 1) Serialise applies per user for the rest of this transaction.
+        #    Must be its own statement: a READ COMMITTED snapshot is taken when a
+        #    statement starts, so the CTE below has to begin after the lock is held.
+        db.execute(text("SELECT pg_advisory_xact_lock(:ns, :uid)"),
+                   {"ns": APPLY_LOCK_NAMESPACE, "uid": current_user.id})
+
+        # 2) Eligibility, refinance cap, interest and insert in one statement.
+        #    Stable-plan interest is the closed form of the weekly decay series
+        #    sum(P * r * (1 - repay)^k, k < weeks); interest-only has repay = 0.
+        row = db.execute(_APPLY_SQL, {
             "uid": current_user.id,
+            "bases": getattr(current_user, "bases", None),
             "lt": loan_type,
             "plan": plan,
             "amount": amount,
             "repay": repay,
-            "ir": interest_rate,
-            "tip": total_interest_paid,
             "weeks": weeks,
-            "endd": end_date,
-        }).mappings().first()
-        db.commit()
-    except Exception as e:
+            "dw": weeks if plan == "interest-only" else None,
+            "refi": loan_type == "refinance" or purpose == "refinancing",
+        }).mappings().one()
+        if row["id"] is None:
+            db.rollback()
+        else:
+            db.commit()
+    except Exception:
         db.rollback()
-        # surface unique-index violations more clearly
-        msg = str(e)
-        if "uniq_active_loan_per_user" in msg or "unique" in msg.lower():
-            raise HTTPException(status_code=400, detail="You already have an active loan.")
         raise
 
+    if row["id"] is None:
+        reason = row["reason"] or "active_loan_exists"
+        if reason == "active_loan_exists":
+            _reject(400, reason, "You already have an active loan.")
+        if reason == "refinance_cap_exceeded":
+            _reject(400, reason, f"Refinance cap is {row['max_refinance']}",
+                    max_amount=int(row["max_refinance"]))
+        if reason == "refinance_not_supported":
+            # uniq_active_loan_per_user allows one active loan per user, so a second
+            # (refinance) loan cannot be granted alongside the existing one.
+            _reject(400, reason, "Refinancing is not available while the current loan is active.")
+        if reason == "tier_not_found":
+            _reject(404, reason, "Eligibility tier not found.")
+        _reject(400, reason, "Amount exceeds eligibility limit.", max_amount=int(row["max_amount"]))
+
     return {
-        "loan_id": ret["id"],
-        "interest_rate": interest_rate,
-        "total_interest": total_interest_paid,
-        "date_granted": ret["date_granted"].isoformat(),
-        "end_date": ret["end_date"].isoformat(),
+        "loan_id": row["id"],
+        "interest_rate": float(row["interest_rate"]),
+        "total_interest": int(row["total_interest_paid"]),
+        "date_granted": row["date_granted"].isoformat(),
+        "end_date": row["end_date"].isoformat(),
     }
-
@@ -0,0 +1,89 @@
+# shadowgate_api/utils/archive_loans.py
+"""
+Move old closed/rejected loans from `loans` into the partitioned `loans_archive`.
+
+Runs in small batches, one transaction each, so it can run alongside traffic:
+rows are picked with FOR UPDATE SKIP LOCKED and moved with a single
+DELETE ... RETURNING -> INSERT statement. Active loans are never touched.
+
+    python -m shadowgate_api.utils.archive_loans [older_than_days] [batch_size]
+
+Space left by the moved rows is reused once (auto)vacuum has run; run
+VACUUM ANALYZE loans after a large first pass so the planner sees the smaller
+table straight away.
+"""
+import os
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from shadowgate_api.db import engine
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("LOANS_ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("LOANS_ARCHIVE_BATCH_SIZE", "5000"))
+
+COLUMNS = (
+    "id, user_id, loan_type, plan, amount, repayment_rate, interest_rate, "
+    "total_interest_paid, duration_weeks, date_granted, end_date, status"
+)
+
+_PICK_BATCH = text("""
+    SELECT id, EXTRACT(YEAR FROM date_granted AT TIME ZONE 'UTC')::int AS yr
+    FROM loans
+    WHERE status IN ('closed', 'rejected')
+      AND COALESCE(end_date, date_granted) < NOW() - make_interval(days => :days)
+    ORDER BY id
+    LIMIT :batch
+    FOR UPDATE SKIP LOCKED
+""")
+
+_MOVE_BATCH = text(f"""
+    WITH moved AS (
+        DELETE FROM loans
+        WHERE id = ANY(:ids)
+        RETURNING {COLUMNS}
+    )
+    INSERT INTO loans_archive ({COLUMNS})
+    SELECT {COLUMNS} FROM moved
+""")
+
+
+def _ensure_partition(conn: Connection, year: int) -> None:
+    # Partition bounds are literals in DDL; year is an int from our own query.
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS loans_archive_{year:d} PARTITION OF loans_archive "
+        f"FOR VALUES FROM ('{year:d}-01-01 00:00:00+00') TO ('{year + 1:d}-01-01 00:00:00+00')"
+    )
+
+
+def archive_closed_loans(
+    conn: Connection,
+    older_than_days: int = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> int:
+    """Archive in batches until nothing eligible is left. Returns rows moved."""
+    total = 0
+    known_years = set()
+    while True:
+        with conn.begin():
+            rows = conn.execute(_PICK_BATCH, {"days": older_than_days, "batch": batch_size}).all()
+            if not rows:
+                break
+            for yr in {r.yr for r in rows} - known_years:
+                _ensure_partition(conn, yr)
+                known_years.add(yr)
+            moved = conn.execute(_MOVE_BATCH, {"ids": [r.id for r in rows]}).rowcount
+        total += moved
+        print(f"[archive] moved {moved} loans (total {total})")
+        if len(rows) < batch_size:
+            break
+    return total
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else ARCHIVE_BATCH_SIZE
+    with engine.connect() as c:
+        n = archive_closed_loans(c, days, batch)
+    print(f"[archive] done; {n} loans archived (older than {days} days)")
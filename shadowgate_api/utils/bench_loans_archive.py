@@ -0,0 +1,142 @@
+# shadowgate_api/utils/bench_loans_archive.py
+"""
+Before/after benchmark for loan archiving on a synthetic history.
+
+Builds models.sql inside a scratch schema, seeds `--rows` historical loans
+(closed/rejected, spread over ~3 years) plus one active loan for every tenth
+user, then prints EXPLAIN (ANALYZE, BUFFERS), latency percentiles and table
+sizes for the hot loan queries before and after archive_closed_loans().
+
+    python -m shadowgate_api.utils.bench_loans_archive --rows 5000000
+
+Never touches the real tables: everything lives in --schema, which is dropped
+at the end unless --keep is given. Loan triggers are disabled in the scratch
+schema so seeding does not publish loan_events notifications.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+
+from shadowgate_api.db import engine
+from shadowgate_api.main import MODELS_SQL, _split_sql_keep_dollar_blocks
+from shadowgate_api.utils.archive_loans import archive_closed_loans
+
+HOT_QUERIES = {
+    "active_by_user": """
+        SELECT id, amount, end_date
+        FROM loans
+        WHERE user_id = :uid AND status = 'active' AND end_date > NOW()
+        ORDER BY end_date DESC
+        LIMIT 1
+    """,
+    "active_view_count": "SELECT count(*) FROM active_loans_v",
+    "user_recent_loans": """
+        SELECT id, status, amount, date_granted
+        FROM loans
+        WHERE user_id = :uid
+        ORDER BY date_granted DESC
+        LIMIT 20
+    """,
+}
+
+_SEED_USERS = text("""
+    INSERT INTO users (username, password_hash, ingame_username, bases)
+    SELECT 'bench_' || g, 'x', 'bench_' || g, 1 + g % 5
+    FROM generate_series(1, :n) g
+""")
+
+_SEED_HISTORY = text("""
+    INSERT INTO loans (user_id, loan_type, plan, amount, repayment_rate, interest_rate,
+                       total_interest_paid, duration_weeks, date_granted, end_date, status)
+    SELECT 1 + (g % :users), 'std', 'interest-only', 1000 + g % 50000, 0, 2.50,
+           100, 4, d, d + INTERVAL '4 weeks',
+           CASE WHEN g % 10 = 0 THEN 'rejected' ELSE 'closed' END
+    FROM generate_series(1, :n) g,
+         LATERAL (SELECT NOW() - INTERVAL '30 days' - (g % 1095) * INTERVAL '1 day' AS d) t
+""")
+
+_SEED_ACTIVE = text("""
+    INSERT INTO loans (user_id, loan_type, plan, amount, repayment_rate, interest_rate,
+                       total_interest_paid, duration_weeks, end_date, status)
+    SELECT u, 'std', 'interest-only', 5000, 0, 2.50, 500, 4, NOW() + INTERVAL '4 weeks', 'active'
+    FROM generate_series(1, :users, 10) u
+""")
+
+
+def _setup(conn, schema: str, rows: int) -> int:
+    users = max(rows // 20, 10)
+    with conn.begin():
+        conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+        conn.exec_driver_sql(f'CREATE SCHEMA "{schema}"')
+        conn.exec_driver_sql(f'SET search_path TO "{schema}"')
+        for stmt in _split_sql_keep_dollar_blocks(MODELS_SQL.read_text(encoding="utf-8")):
+            conn.exec_driver_sql(stmt)
+        conn.exec_driver_sql("ALTER TABLE loans DISABLE TRIGGER USER")
+    t0 = time.perf_counter()
+    with conn.begin():
+        conn.execute(_SEED_USERS, {"n": users})
+        conn.execute(_SEED_HISTORY, {"n": rows, "users": users})
+        conn.execute(_SEED_ACTIVE, {"users": users})
+    print(f"[bench] seeded {rows} historical loans for {users} users in {time.perf_counter() - t0:.1f}s")
+    return users
+
+
+def _vacuum(schema: str) -> None:
+    with engine.connect() as c:
+        c = c.execution_options(isolation_level="AUTOCOMMIT")
+        c.exec_driver_sql(f'VACUUM ANALYZE "{schema}".loans')
+
+
+def _report(conn, label: str, users: int, iterations: int) -> None:
+    print(f"\n===== {label} =====")
+    with conn.begin():
+        size = conn.execute(text(
+            "SELECT pg_size_pretty(pg_total_relation_size('loans')), (SELECT count(*) FROM loans)"
+        )).one()
+        print(f"loans: {size[1]} rows, {size[0]} incl. indexes")
+        for name, sql in HOT_QUERIES.items():
+            uid = random.randint(1, users)
+            plan = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + sql), {"uid": uid}).scalars().all()
+            timings = []
+            for _ in range(iterations):
+                uid = random.randint(1, users)
+                t0 = time.perf_counter()
+                conn.execute(text(sql), {"uid": uid}).all()
+                timings.append((time.perf_counter() - t0) * 1000.0)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"\n-- {name}: median {statistics.median(timings):.2f} ms, p95 {p95:.2f} ms ({iterations} runs)")
+            print("\n".join(plan))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=2_000_000)
+    ap.add_argument("--iterations", type=int, default=200)
+    ap.add_argument("--older-than-days", type=int, default=30)
+    ap.add_argument("--schema", default="bench_loans_archive")
+    ap.add_argument("--keep", action="store_true", help="keep the scratch schema afterwards")
+    args = ap.parse_args()
+
+    with engine.connect() as conn:
+        users = _setup(conn, args.schema, args.rows)
+        _vacuum(args.schema)
+        _report(conn, "BEFORE archiving", users, args.iterations)
+
+        t0 = time.perf_counter()
+        moved = archive_closed_loans(conn, args.older_than_days)
+        print(f"\n[bench] archived {moved} loans in {time.perf_counter() - t0:.1f}s")
+        _vacuum(args.schema)
+        _report(conn, "AFTER archiving", users, args.iterations)
+
+        with conn.begin():
+            if not args.keep:
+                conn.exec_driver_sql(f'DROP SCHEMA "{args.schema}" CASCADE')
+            conn.exec_driver_sql("RESET search_path")
+
+
+if __name__ == "__main__":
+    main()